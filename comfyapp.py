@@ -1,8 +1,12 @@
-import filecmp
+import errno
+import mmap
 import os
+import re
 import shutil
 import subprocess
 import textwrap
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 
 import modal
@@ -20,11 +24,33 @@ COMFY_ROOT_CANDIDATES = [
     Path("/root/ComfyUI"),
     Path("/root/.cache/comfyui/ComfyUI"),
 ]
+# イメージビルド時に検出した ComfyUI のルートを 1 行ずつ記録するファイル
+COMFY_ROOT_RECORD = Path("/etc/comfy_root")
 CUSTOM_NODE_VOLUME_MOUNT = Path("/data/custom_nodes")
 OUTPUT_VOLUME_MOUNT = Path("/data/output")
 INPUT_VOLUME_MOUNT = Path("/data/input")
 USER_DATA_VOLUME_MOUNT = Path("/data/user")
+COMPARE_CHUNK_SIZE = 1 << 20
+NVIDIA_DEVICE_PATHS = ("/dev/nvidiactl", "/dev/nvidia0", "/dev/nvidia-uvm")
+USER_DATA_ROUTE_REPLACEMENTS = {
+    '@routes.get("/userdata/{file}")': '@routes.get(r"/userdata/{file:.*}")',
+    "@routes.get('/userdata/{file}')": "@routes.get(r'/userdata/{file:.*}')",
+    '@routes.post("/userdata/{file}")': '@routes.post(r"/userdata/{file:.*}")',
+    "@routes.post('/userdata/{file}')": "@routes.post(r'/userdata/{file:.*}')",
+    '@routes.delete("/userdata/{file}")': '@routes.delete(r"/userdata/{file:.*}")',
+    "@routes.delete('/userdata/{file}')": "@routes.delete(r'/userdata/{file:.*}')",
+    '@routes.post("/userdata/{file}/move/{dest}")': '@routes.post(r"/userdata/{file:.*}/move/{dest:.*}")',
+    "@routes.post('/userdata/{file}/move/{dest}')": "@routes.post(r'/userdata/{file:.*}/move/{dest:.*}')",
+}
+USER_DATA_ROUTE_PATTERN = re.compile(
+    "|".join(re.escape(original) for original in USER_DATA_ROUTE_REPLACEMENTS)
+)
+USER_DATA_ROUTE_BYTES_PATTERN = re.compile(USER_DATA_ROUTE_PATTERN.pattern.encode())
+# パッチ内容を変えた場合は値を更新し、既存のセンチネルを無効化する
+WORKFLOWS_PATCH_VERSION = "v1"
+WORKFLOWS_PATCH_SENTINEL_NAME = ".modal_workflows_patch"
 WORKFLOWS_PATCH_MARKER = "# MODAL_PATCH_ALLOW_WORKFLOWS_START"
+WORKFLOWS_PATCH_MARKER_BYTES = WORKFLOWS_PATCH_MARKER.encode()
 WORKFLOWS_PATCH_SNIPPET = textwrap.dedent(
     """
     # MODAL_PATCH_ALLOW_WORKFLOWS_START
@@ -66,6 +92,293 @@ NODES = [
     "https://github.com/rgthree/rgthree-comfy",
 ]
 
+
+def _patch_signature(path: Path) -> str:
+    """センチネルに記録するパッチ適用済みファイルの識別子を返す"""
+
+    stat_result = path.stat()
+    return (
+        f"{WORKFLOWS_PATCH_VERSION}:{stat_result.st_size}:{stat_result.st_mtime_ns}"
+    )
+
+
+def _record_patched(path: Path) -> None:
+    """パッチ適用済みであることをセンチネルファイルに記録する"""
+
+    sentinel = path.with_name(WORKFLOWS_PATCH_SENTINEL_NAME)
+    try:
+        sentinel.write_text(_patch_signature(path), encoding="utf-8")
+    except OSError as exc:
+        print(f"警告: {sentinel} の書き込みに失敗しました: {exc}")
+
+
+def patch_user_manager_for_workflows(comfy_root: Path) -> None:
+    """ComfyUI のユーザーデータ API を補正し workflows 保存を許可する"""
+    candidate_paths = [
+        comfy_root / "comfy" / "ui" / "user_manager.py",
+        comfy_root / "app" / "user_manager.py",
+    ]
+
+    for user_manager_path in candidate_paths:
+        if not user_manager_path.exists():
+            continue
+
+        # 前回パッチ適用後から変化していなければ読み込み自体を省く
+        sentinel = user_manager_path.with_name(WORKFLOWS_PATCH_SENTINEL_NAME)
+        try:
+            if sentinel.read_text(encoding="utf-8") == _patch_signature(
+                user_manager_path
+            ):
+                continue
+        except OSError:
+            pass
+
+        # デコードせずにバイト列のまま、パッチが必要かどうかだけを先に調べる
+        try:
+            with user_manager_path.open("rb") as raw_file, mmap.mmap(
+                raw_file.fileno(), 0, access=mmap.ACCESS_READ
+            ) as mapped:
+                has_marker = mapped.find(WORKFLOWS_PATCH_MARKER_BYTES) != -1
+                needs_routes = USER_DATA_ROUTE_BYTES_PATTERN.search(mapped) is not None
+        except ValueError:  # 空ファイルは mmap できない
+            has_marker = needs_routes = False
+        except OSError as exc:
+            print(f"警告: {user_manager_path} の読み込みに失敗しました: {exc}")
+            continue
+
+        if has_marker and not needs_routes:
+            _record_patched(user_manager_path)
+            continue
+
+        try:
+            if needs_routes:
+                content = user_manager_path.read_text(encoding="utf-8")
+                # 置換後のルートが既にあるものは残し、再適用で二重にならないようにする
+                already_patched = {
+                    original
+                    for original, replacement in USER_DATA_ROUTE_REPLACEMENTS.items()
+                    if replacement in content
+                }
+                updated = USER_DATA_ROUTE_PATTERN.sub(
+                    lambda match: (
+                        match.group(0)
+                        if match.group(0) in already_patched
+                        else USER_DATA_ROUTE_REPLACEMENTS[match.group(0)]
+                    ),
+                    content,
+                )
+                if not has_marker:
+                    updated = f"{updated}\n{WORKFLOWS_PATCH_SNIPPET}"
+                user_manager_path.write_text(updated, encoding="utf-8")
+            else:
+                # ルートの置換が不要なら末尾への追記だけで済ませる
+                with user_manager_path.open("ab") as raw_file:
+                    raw_file.write(f"\n{WORKFLOWS_PATCH_SNIPPET}".encode("utf-8"))
+            print(f"{user_manager_path} に workflows 保存許可パッチを適用しました")
+        except OSError as exc:
+            print(f"警告: {user_manager_path} の書き込みに失敗しました: {exc}")
+            continue
+        _record_patched(user_manager_path)
+
+
+def prepare_comfy_image() -> None:
+    """イメージビルド時に ComfyUI へのパッチを適用し、起動時の処理を減らす"""
+
+    for comfy_root in COMFY_ROOT_CANDIDATES:
+        if comfy_root.exists():
+            patch_user_manager_for_workflows(comfy_root)
+
+
+def _warm_up_nvidia_devices() -> list[int]:
+    """NVIDIA デバイスを先に開き、ドライバの初期化待ちを起動処理と重ねる
+
+    最後の fd を閉じるとドライバの状態が破棄されるため、開いた fd を返して呼び出し側で保持する。
+    """
+
+    device_fds = []
+    for device_path in NVIDIA_DEVICE_PATHS:
+        try:
+            device_fds.append(os.open(device_path, os.O_RDWR | os.O_CLOEXEC))
+        except OSError:
+            pass
+    return device_fds
+
+
+def _release_devices_on_exit(
+    process: subprocess.Popen, warm_up: Future[list[int]]
+) -> None:
+    """ComfyUI プロセスの終了まで NVIDIA デバイスの fd を保持し、終了後に閉じる"""
+
+    process.wait()
+    for device_fd in warm_up.result():
+        os.close(device_fd)
+
+
+def _detect_comfy_roots() -> list[Path]:
+    """ビルド時の記録から ComfyUI のルートを取得し、記録が無い場合のみ候補を走査する"""
+
+    try:
+        recorded = COMFY_ROOT_RECORD.read_text(encoding="utf-8").split()
+    except OSError:
+        return [root_dir for root_dir in COMFY_ROOT_CANDIDATES if root_dir.exists()]
+    return [Path(root_dir) for root_dir in recorded]
+
+
+def _contents_identical(left: str, right: Path) -> bool:
+    """同じサイズのファイル同士をチャンク単位で比較し、最初の差分で打ち切る"""
+
+    with open(left, "rb") as left_file, right.open("rb") as right_file:
+        while True:
+            left_chunk = left_file.read(COMPARE_CHUNK_SIZE)
+            if left_chunk != right_file.read(COMPARE_CHUNK_SIZE):
+                return False
+            if not left_chunk:
+                return True
+
+
+def _partition_file_collisions(
+    collisions: list[tuple[os.DirEntry, Path]],
+) -> tuple[list[os.DirEntry], list[tuple[os.DirEntry, Path]]]:
+    """衝突したファイルをサイズで先に振り分け、同サイズの組だけ内容を比較する"""
+
+    sized: list[tuple[os.DirEntry, Path]] = []
+    mismatched: list[tuple[os.DirEntry, Path]] = []
+    for entry, destination in collisions:
+        try:
+            same_size = (
+                destination.is_file()
+                and entry.stat().st_size == destination.stat().st_size
+            )
+        except OSError:
+            same_size = False
+        (sized if same_size else mismatched).append((entry, destination))
+
+    identical: list[os.DirEntry] = []
+    for entry, destination in sized:
+        try:
+            same_file = _contents_identical(entry.path, destination)
+        except OSError:
+            same_file = False
+        if same_file:
+            identical.append(entry)
+        else:
+            mismatched.append((entry, destination))
+    return identical, mismatched
+
+
+def _move_entry(source_path: str, destination: Path) -> None:
+    """同一デバイス上では rename のみで移動し、デバイスを跨ぐ場合だけコピーに頼る"""
+
+    try:
+        os.rename(source_path, destination)
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+        shutil.move(source_path, destination)
+
+
+def _unique_backup_path(destination: Path, suffix: str) -> Path:
+    """退避先が既にある場合は連番を付け、既存の退避ファイルを上書きしないようにする"""
+
+    base = destination.with_suffix(suffix)
+    backup = base
+    counter = 1
+    while os.path.lexists(backup):
+        backup = base.with_name(f"{base.name}.{counter}")
+        counter += 1
+    return backup
+
+
+def _merge_directory_contents(source_dir: Path, target_dir: Path) -> None:
+    """対象ディレクトリの中身をソースディレクトリへ統合する"""
+
+    # 移動中のディレクトリを走査し続けないよう、エントリを先に確定させる
+    with os.scandir(target_dir) as iterator:
+        entries = list(iterator)
+
+    file_collisions: list[tuple[os.DirEntry, Path]] = []
+    for entry in entries:
+        destination = source_dir / entry.name
+
+        if entry.is_dir(follow_symlinks=False):
+            if destination.exists():
+                if destination.is_dir():
+                    if entry.stat(follow_symlinks=False).st_dev == (
+                        destination.stat().st_dev
+                    ):
+                        # 同じファイルシステム上なら中身を rename で再帰的に統合する
+                        _merge_directory_contents(destination, Path(entry.path))
+                        os.rmdir(entry.path)
+                    else:
+                        shutil.copytree(entry.path, destination, dirs_exist_ok=True)
+                        shutil.rmtree(entry.path)
+                else:
+                    backup = _unique_backup_path(destination, ".dir_conflict")
+                    _move_entry(entry.path, backup)
+            else:
+                _move_entry(entry.path, destination)
+        elif destination.exists():
+            file_collisions.append((entry, destination))
+        else:
+            _move_entry(entry.path, destination)
+
+    # 内容比較が必要な組を絞り込んでからまとめて処理する
+    identical, mismatched = _partition_file_collisions(file_collisions)
+    for entry in identical:
+        os.unlink(entry.path)
+    for entry, destination in mismatched:
+        _move_entry(entry.path, _unique_backup_path(destination, ".conflict"))
+
+
+def _is_empty_directory(path: Path) -> bool:
+    """最初のエントリだけを読み、ディレクトリが空かどうかを判定する"""
+
+    with os.scandir(path) as iterator:
+        return next(iterator, None) is None
+
+
+def link_directory(target: Path, source: Path) -> bool:
+    """指定ディレクトリを永続化 Volume に向ける。source と target の親は作成済みであること"""
+
+    if target.is_symlink():
+        if os.readlink(target) != str(source):
+            target.unlink()
+            target.symlink_to(source, target_is_directory=True)
+        return True
+
+    if target.exists():
+        if target.is_dir():
+            # 新しいコンテナでは空ディレクトリが大半なので統合処理を丸ごと省く
+            if not _is_empty_directory(target):
+                _merge_directory_contents(source, target)
+                if not _is_empty_directory(target):
+                    print(
+                        f"警告: {target} を空にできなかったためシンボリックリンクを作成しません"
+                    )
+                    return False
+            target.rmdir()
+            target.symlink_to(source, target_is_directory=True)
+            return True
+
+        print(
+            f"警告: {target} は既存ファイルのためシンボリックリンクを作成しません"
+        )
+        return False
+
+    target.symlink_to(source, target_is_directory=True)
+    return True
+
+
+def _link_group(group: list[tuple[Path, Path, str]]) -> list[str]:
+    """同じ Volume を接続先とする組を順に接続し、成功時のメッセージを返す"""
+
+    return [
+        message
+        for target, source, message in group
+        if link_directory(target, source)
+    ]
+
+
 # イメージファイルの作成
 image = (
     modal.Image.debian_slim(python_version="3.11")
@@ -100,7 +413,15 @@ image = (
         "gguf",
     )
     .run_commands("comfy --skip-prompt install --nvidia")
+    .run_commands(
+        "for p in "
+        + " ".join(root_dir.as_posix() for root_dir in COMFY_ROOT_CANDIDATES)
+        + '; do if [ -d "$p" ]; then echo "$p"; fi; done > '
+        + COMFY_ROOT_RECORD.as_posix()
+    )
     .run_commands(*[f"comfy node install {node}" for node in NODES])
+    # ノードのレイヤーキャッシュを保つため、パッチ適用は最後に行う
+    .run_function(prepare_comfy_image)
 )
 
 app = modal.App(name="comfyui", image=image)
@@ -122,151 +443,95 @@ app = modal.App(name="comfyui", image=image)
 @modal.concurrent(max_inputs=10)
 @modal.web_server(8000, startup_timeout=60)
 def ui():
-    CUSTOM_NODE_VOLUME_MOUNT.mkdir(parents=True, exist_ok=True)
-    OUTPUT_VOLUME_MOUNT.mkdir(parents=True, exist_ok=True)
-    INPUT_VOLUME_MOUNT.mkdir(parents=True, exist_ok=True)
-    MODEL_VOLUME_DIR.mkdir(parents=True, exist_ok=True)
-    USER_DATA_VOLUME_MOUNT.mkdir(parents=True, exist_ok=True)
+    # ボリュームの統合処理と並行してドライバ初期化を進める
+    warm_up_executor = ThreadPoolExecutor(max_workers=1)
+    warm_up = warm_up_executor.submit(_warm_up_nvidia_devices)
+    warm_up_executor.shutdown(wait=False)
 
-    comfy_roots = [root_dir for root_dir in COMFY_ROOT_CANDIDATES if root_dir.exists()]
+    comfy_roots = _detect_comfy_roots()
     if not comfy_roots:
         # どの候補も存在しない場合は最初の候補を作成ターゲットとして扱う。
         comfy_roots.append(COMFY_ROOT_CANDIDATES[0])
 
-    def _merge_directory_contents(source_dir: Path, target_dir: Path) -> None:
-        """対象ディレクトリの中身をソースディレクトリへ統合する"""
-
-        for item in list(target_dir.iterdir()):
-            destination = source_dir / item.name
-
-            if item.is_dir():
-                if destination.exists():
-                    if destination.is_dir():
-                        shutil.copytree(item, destination, dirs_exist_ok=True)
-                        shutil.rmtree(item)
-                    else:
-                        backup = destination.with_suffix(".dir_conflict")
-                        shutil.move(str(item), backup)
-                else:
-                    shutil.move(str(item), destination)
-            else:
-                if destination.exists():
-                    try:
-                        same_file = destination.is_file() and filecmp.cmp(
-                            item, destination, shallow=False
-                        )
-                    except OSError:
-                        same_file = False
-                    if same_file:
-                        item.unlink()
-                    else:
-                        backup = destination.with_suffix(".conflict")
-                        shutil.move(str(item), backup)
-                else:
-                    shutil.move(str(item), destination)
-
-    def patch_user_manager_for_workflows(comfy_root: Path) -> None:
-        """ComfyUI のユーザーデータ API を補正し workflows 保存を許可する"""
-        candidate_paths = [
-            comfy_root / "comfy" / "ui" / "user_manager.py",
-            comfy_root / "app" / "user_manager.py",
-        ]
-
-        replacements = {
-            '@routes.get("/userdata/{file}")': '@routes.get(r"/userdata/{file:.*}")',
-            "@routes.get('/userdata/{file}')": "@routes.get(r'/userdata/{file:.*}')",
-            '@routes.post("/userdata/{file}")': '@routes.post(r"/userdata/{file:.*}")',
-            "@routes.post('/userdata/{file}')": "@routes.post(r'/userdata/{file:.*}')",
-            '@routes.delete("/userdata/{file}")': '@routes.delete(r"/userdata/{file:.*}")',
-            "@routes.delete('/userdata/{file}')": "@routes.delete(r'/userdata/{file:.*}')",
-            '@routes.post("/userdata/{file}/move/{dest}")': '@routes.post(r"/userdata/{file:.*}/move/{dest:.*}")',
-            "@routes.post('/userdata/{file}/move/{dest}')": "@routes.post(r'/userdata/{file:.*}/move/{dest:.*}')",
-        }
-
-        for user_manager_path in candidate_paths:
-            if not user_manager_path.exists():
-                continue
-
-            try:
-                content = user_manager_path.read_text(encoding="utf-8")
-            except OSError as exc:
-                print(f"警告: {user_manager_path} の読み込みに失敗しました: {exc}")
-                continue
-
-            updated = content
-            modified = False
-
-            for original, replacement in replacements.items():
-                if replacement not in updated and original in updated:
-                    updated = updated.replace(original, replacement)
-                    modified = True
-
-            if WORKFLOWS_PATCH_MARKER not in updated:
-                updated = f"{updated}\n{WORKFLOWS_PATCH_SNIPPET}"
-                modified = True
-
-            if not modified:
-                continue
-
-            try:
-                user_manager_path.write_text(updated, encoding="utf-8")
-                print(f"{user_manager_path} に workflows 保存許可パッチを適用しました")
-            except OSError as exc:
-                print(f"警告: {user_manager_path} の書き込みに失敗しました: {exc}")
-
-    def link_directory(target: Path, source: Path) -> bool:
-        """指定ディレクトリを永続化 Volume に向ける"""
-
-        source.mkdir(parents=True, exist_ok=True)
-        target.parent.mkdir(parents=True, exist_ok=True)
-
-        if target.is_symlink():
-            current_target = Path(os.readlink(target))
-            if current_target != source:
-                target.unlink()
-                target.symlink_to(source, target_is_directory=True)
-            return True
-
-        if target.exists():
-            if target.is_dir():
-                _merge_directory_contents(source, target)
-                if any(target.iterdir()):
-                    print(
-                        f"警告: {target} を空にできなかったためシンボリックリンクを作成しません"
-                    )
-                    return False
-                target.rmdir()
-                target.symlink_to(source, target_is_directory=True)
-                return True
-
-            print(
-                f"警告: {target} は既存ファイルのためシンボリックリンクを作成しません"
-            )
-            return False
-
-        target.symlink_to(source, target_is_directory=True)
-        return True
-
+    link_pairs: list[tuple[Path, Path, str]] = []
     for comfy_root in comfy_roots:
         patch_user_manager_for_workflows(comfy_root)
         models_dir = comfy_root / "models"
+        link_pairs.extend(
+            [
+                (
+                    models_dir,
+                    MODEL_VOLUME_DIR,
+                    f"{models_dir} を {MODEL_VOLUME_DIR} に接続しました",
+                ),
+                (
+                    comfy_root / "custom_nodes",
+                    CUSTOM_NODE_VOLUME_MOUNT,
+                    f"{comfy_root} の custom_nodes を永続化 Volume に接続しました",
+                ),
+                (
+                    comfy_root / "output",
+                    OUTPUT_VOLUME_MOUNT,
+                    f"{comfy_root} の output を永続化 Volume に接続しました",
+                ),
+                (
+                    comfy_root / "input",
+                    INPUT_VOLUME_MOUNT,
+                    f"{comfy_root} の input を永続化 Volume に接続しました",
+                ),
+                (
+                    comfy_root / "user",
+                    USER_DATA_VOLUME_MOUNT,
+                    f"{comfy_root} の user ディレクトリを永続化 Volume に接続しました",
+                ),
+            ]
+        )
 
-        if link_directory(models_dir, MODEL_VOLUME_DIR):
-            print(f"{models_dir} を {MODEL_VOLUME_DIR} に接続しました")
-
-        if link_directory(comfy_root / "custom_nodes", CUSTOM_NODE_VOLUME_MOUNT):
-            print(f"{comfy_root} の custom_nodes を永続化 Volume に接続しました")
-
-        if link_directory(comfy_root / "output", OUTPUT_VOLUME_MOUNT):
-            print(f"{comfy_root} の output を永続化 Volume に接続しました")
-
-        if link_directory(comfy_root / "input", INPUT_VOLUME_MOUNT):
-            print(f"{comfy_root} の input を永続化 Volume に接続しました")
-
-        if link_directory(comfy_root / "user", USER_DATA_VOLUME_MOUNT):
-            print(f"{comfy_root} の user ディレクトリを永続化 Volume に接続しました")
-
-    subprocess.Popen(
-        "comfy launch -- --listen 0.0.0.0 --port 8000 --use-sage-attention",
-        shell=True,
+    # 同じ親ディレクトリを何度も辿らないよう、必要なディレクトリを一度だけ作成する
+    required_dirs = {source for _, source, _ in link_pairs} | {
+        target.parent for target, _, _ in link_pairs
+    }
+    for required_dir in required_dirs:
+        required_dir.mkdir(parents=True, exist_ok=True)
+
+    # 同じ Volume への統合同士が競合しないよう、接続先 Volume ごとに並列化する
+    pairs_by_source: dict[Path, list[tuple[Path, Path, str]]] = {}
+    for link_pair in link_pairs:
+        pairs_by_source.setdefault(link_pair[1], []).append(link_pair)
+
+    with ThreadPoolExecutor(max_workers=len(pairs_by_source)) as executor:
+        for messages in executor.map(_link_group, pairs_by_source.values()):
+            for message in messages:
+                print(message)
+
+    # 起動時の統合結果を確定させ、ComfyUI の起動中に同期待ちが起きないようにする
+    for startup_volume in (
+        volume,
+        custom_node_volume,
+        output_volume,
+        input_volume,
+        user_data_volume,
+    ):
+        try:
+            startup_volume.commit()
+        except modal.exception.ModalError as exc:
+            print(f"警告: Volume のコミットに失敗しました: {exc}")
+
+    # web_server は関数の復帰を待つため exec はせず、シェルを挟まずに直接起動する
+    process = subprocess.Popen(
+        [
+            "comfy",
+            "launch",
+            "--",
+            "--listen",
+            "0.0.0.0",
+            "--port",
+            "8000",
+            "--use-sage-attention",
+        ],
+        close_fds=True,
     )
+    # ComfyUI が CUDA を初期化し終えるまでドライバの状態を保つため、fd はプロセス終了後に閉じる
+    threading.Thread(
+        target=_release_devices_on_exit, args=(process, warm_up), daemon=True
+    ).start()
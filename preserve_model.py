@@ -1,33 +1,47 @@
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 
 from datetime import datetime, timezone
-import shutil
+import json
+import os
 
 import modal
 
 # create a Volume, or retrieve it if     it exists
 volume = modal.Volume.from_name("comfy-model", create_if_missing=True)
 MODEL_DIR = Path("/models")
-COMFY_MODEL_SUBDIRS = {
-    "checkpoints",
-    "diffusion_models",
-    "loras",
-    "text_encoders",
-    "audio_encoders",
-    "clip",
-    "clip_vision",
-    "controlnet",
-    "vae",
-    "embeddings",
-    "upscale_models",
-}
+# ComfyUI の保存先と同じ Volume 上に置き、完成したファイルだけを rename で移動する
+DOWNLOAD_STAGING_DIR = MODEL_DIR / ".hf_download"
+# 保存したファイルごとに取得元のリポジトリ・リビジョンを記録し、再実行時の省略判定に使う
+DOWNLOAD_RECORD_DIR = MODEL_DIR / ".preserve_records"
+SNAPSHOT_MAX_WORKERS = 8
+COMFY_MODEL_SUBDIRS = frozenset(
+    {
+        "checkpoints",
+        "diffusion_models",
+        "loras",
+        "text_encoders",
+        "audio_encoders",
+        "clip",
+        "clip_vision",
+        "controlnet",
+        "vae",
+        "embeddings",
+        "upscale_models",
+    }
+)
 
 # define dependencies for downloading model
 download_image = (
     modal.Image.debian_slim()
     .pip_install("huggingface_hub[hf_transfer]")  # install fast Rust download client
-    .env({"HF_HUB_ENABLE_HF_TRANSFER": "1"})  # and enable it
+    .env(
+        {
+            "HF_HUB_ENABLE_HF_TRANSFER": "1",  # and enable it
+            # メタデータのキャッシュを Volume に置き、実行をまたいで再利用する
+            "HF_HOME": (MODEL_DIR / ".hf_cache").as_posix(),
+        }
+    )
 )
 app = modal.App("preserve-model")
 
@@ -44,8 +58,11 @@ def preserve_model(
     filename: Optional[str] = None,
     revision: Optional[str] = None,
     destination_subdir: Optional[str] = None,
+    filenames: Optional[Union[str, list[str]]] = None,
 ):
-    from huggingface_hub import hf_hub_download
+    """モデルを Volume に保存する。filenames にはリストかカンマ区切りで複数ファイルを指定できる"""
+
+    from huggingface_hub import HfApi, hf_hub_download, snapshot_download
 
     def _resolve_destination(filename: str, destination_subdir: Optional[str]) -> Path:
         """保存先のフルパスを決定する。ルート直下にファイルを配置する"""
@@ -73,30 +90,155 @@ def preserve_model(
         target_root.mkdir(parents=True, exist_ok=True)
         return target_root / filename_path.name
 
+    def _resolve_commit() -> str:
+        """ブランチやタグは指す先が変わるため、取得・記録に使うコミット sha に解決する"""
+
+        return HfApi().model_info(repo_id, revision=revision).sha
+
+    def _record_path(destination_path: Path) -> Path:
+        """保存先ごとの取得元記録のパスを返す"""
+
+        relative = destination_path.relative_to(MODEL_DIR)
+        return DOWNLOAD_RECORD_DIR / relative.with_name(relative.name + ".json")
+
+    def _source_record(filename: str) -> dict:
+        """省略判定に使う取得元の情報をまとめる"""
+
+        return {"repo_id": repo_id, "filename": filename, "commit": commit}
+
+    def _existing_size(path: Path, filename: str) -> Optional[int]:
+        """同じリポジトリ・コミット・ファイルから保存済みの場合のみサイズを返す"""
+
+        try:
+            size = path.stat().st_size
+            recorded = json.loads(_record_path(path).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if size <= 0 or recorded != _source_record(filename):
+            return None
+        return size
+
+    def _move_into_place(
+        downloaded_path: Path, destination_path: Path, filename: str
+    ) -> None:
+        """作業ディレクトリのファイルを保存先へ rename し、空になった階層を片付ける"""
+
+        # 差し替え前に古い記録を消し、途中で失敗しても誤って省略されないようにする
+        record_path = _record_path(destination_path)
+        record_path.unlink(missing_ok=True)
+        moved = downloaded_path.resolve() != destination_path.resolve()
+        if moved:
+            os.replace(downloaded_path, destination_path)
+        record_path.parent.mkdir(parents=True, exist_ok=True)
+        record_path.write_text(json.dumps(_source_record(filename)), encoding="utf-8")
+        if not moved:
+            return
+        for parent in downloaded_path.parents:
+            if parent == DOWNLOAD_STAGING_DIR:
+                break
+            try:
+                parent.rmdir()
+            except OSError:
+                break
+
     if not repo_id:
         raise ValueError("repo_id を必ず指定してください")
-    if not filename:
-        raise ValueError("filename を必ず指定してください")
 
+    if isinstance(filenames, str):
+        filenames = filenames.split(",")
+    # 同じファイルの重複指定は 1 つにまとめる
+    requested = list(
+        dict.fromkeys(
+            name.strip() for name in [filename or "", *(filenames or ())] if name.strip()
+        )
+    )
+    if not requested:
+        raise ValueError("filename または filenames を必ず指定してください")
+
+    if len(requested) > 1:
+        # 複数ファイルは snapshot_download で並列に取得し、コンテナ起動を 1 回で済ませる
+        destinations = {
+            name: _resolve_destination(name, destination_subdir) for name in requested
+        }
+        # 別々のファイルが同じ保存先になると後から移動した方で上書きされるため、取得前に止める
+        claimed: dict[Path, str] = {}
+        for name, destination_path in destinations.items():
+            if destination_path in claimed:
+                raise ValueError(
+                    f"{claimed[destination_path]} と {name} の保存先が同じ"
+                    f" {destination_path} になります"
+                )
+            claimed[destination_path] = name
+        commit = _resolve_commit()
+        pending = [
+            name
+            for name, destination_path in destinations.items()
+            if _existing_size(destination_path, name) is None
+        ]
+        if pending:
+            snapshot_download(
+                repo_id=repo_id,
+                revision=commit,
+                allow_patterns=pending,
+                local_dir=DOWNLOAD_STAGING_DIR,
+                max_workers=SNAPSHOT_MAX_WORKERS,
+            )
+        for name in pending:
+            downloaded_path = DOWNLOAD_STAGING_DIR / name
+            if not downloaded_path.exists():
+                raise FileNotFoundError(
+                    f"{name} がリポジトリ {repo_id} に見つかりませんでした"
+                )
+            _move_into_place(downloaded_path, destinations[name], name)
+            print(f"モデルファイルを {destinations[name]} に保存しました")
+        completed_at = datetime.now(timezone.utc).isoformat()
+        return {
+            "files": [
+                {
+                    "destination": destination_path.as_posix(),
+                    "size_bytes": destination_path.stat().st_size,
+                    "skipped": name not in pending,
+                }
+                for name, destination_path in destinations.items()
+            ],
+            "commit": commit,
+            "completed_at": completed_at,
+        }
+
+    filename = requested[0]
     filename_path = Path(filename)
     destination_path = _resolve_destination(filename, destination_subdir)
+    commit = _resolve_commit()
+    existing_size = _existing_size(destination_path, filename)
+    if existing_size is not None:
+        print(f"同じコミットのモデルファイルが既に {destination_path} に存在します")
+        return {
+            "destination": destination_path.as_posix(),
+            "size_bytes": existing_size,
+            "commit": commit,
+            "completed_at": datetime.now(timezone.utc).isoformat(),
+            "skipped": True,
+        }
+
+    # Volume 上の作業ディレクトリへ直接ダウンロードし、保存先へは rename のみで移す
     downloaded_path = Path(
         hf_hub_download(
             repo_id=repo_id,
             filename=filename_path.as_posix(),
-            revision=revision,
+            revision=commit,
+            local_dir=DOWNLOAD_STAGING_DIR,
             local_dir_use_symlinks=False,
             resume_download=True,
         )
     )
-    if downloaded_path.resolve() != destination_path.resolve():
-        shutil.copy2(downloaded_path, destination_path)
-        downloaded_path = destination_path
-    file_stat = downloaded_path.stat()
+    _move_into_place(downloaded_path, destination_path, filename)
+    file_stat = destination_path.stat()
     completed_at = datetime.now(timezone.utc).isoformat()
-    print(f"モデルファイルを {downloaded_path} に保存しました")
+    print(f"モデルファイルを {destination_path} に保存しました")
     return {
         "destination": destination_path.as_posix(),
         "size_bytes": file_stat.st_size,
+        "commit": commit,
         "completed_at": completed_at,
+        "skipped": False,
     }
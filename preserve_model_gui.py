@@ -4,32 +4,43 @@ from __future__ import annotations
 
 import argparse
 import asyncio
-import importlib.util
+import atexit
+import concurrent.futures
+import functools
+import io
 from dataclasses import dataclass
 from pathlib import Path
 import threading
 import os
-from typing import Optional, Tuple, Any
-from urllib.parse import urlparse
+import re
+import sys
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Optional, Tuple
 
-import gradio as gr
 from modal import Function, FunctionCall
+from modal.exception import ClientClosed as ModalClientClosed
 from modal.exception import ConnectionError as ModalConnectionError
 from modal.exception import InvalidError as ModalInvalidError
 from modal.exception import NotFoundError as ModalNotFoundError
 from modal.exception import RemoteError as ModalRemoteError
 from modal.exception import TimeoutError as ModalTimeoutError
 
-# preserve_model.py を動的に読み込んで、元の関数や定数を再利用する
-_MODULE_PATH = Path(__file__).with_name("preserve_model.py")
-_SPEC = importlib.util.spec_from_file_location("preserve_model_module", _MODULE_PATH)
-_MODULE = importlib.util.module_from_spec(_SPEC)
-assert _SPEC.loader is not None
-_SPEC.loader.exec_module(_MODULE)
+# gradio は依存が大きいため、UI を組み立てるときまで import を遅らせる
+if TYPE_CHECKING:
+    import gradio as gr
+
+# preserve_model.py を通常の import で読み込み、__pycache__ のバイトコードを再利用する
+_MODULE_DIR = str(Path(__file__).resolve().parent)
+if _MODULE_DIR not in sys.path:
+    sys.path.insert(0, _MODULE_DIR)
+import preserve_model as _MODULE  # noqa: E402
 
 _PRESERVE_FUNCTION = _MODULE.preserve_model
 _APP = _MODULE.app
-_COMFY_MODEL_SUBDIRS = sorted(_MODULE.COMFY_MODEL_SUBDIRS)
+# 共有の frozenset をそのまま使い、自動判定の照合を O(1) にする
+_COMFY_MODEL_SUBDIRS_SET = _MODULE.COMFY_MODEL_SUBDIRS
+_AUTO_SUBDIR_CHOICE = "(自動判定)"
+# 並び順が必要なのはプルダウンだけなので、ソートはここで一度だけ行う
+_SUBDIR_CHOICES = (_AUTO_SUBDIR_CHOICE, *sorted(_COMFY_MODEL_SUBDIRS_SET))
 
 
 @dataclass
@@ -53,144 +64,275 @@ CONFIG = AppConfig(
 )
 
 
-async def _run_aio_or_sync(callable_obj, *args, **kwargs):
-    """callable_obj.aio(...) があれば await し、なければ同期版をスレッド経由で実行する"""
+@dataclass(frozen=True)
+class _CallablePair:
+    """同期版の呼び出しと .aio 版を一度だけ解決して保持する"""
+
+    sync: Callable[..., Any]
+    aio: Optional[Callable[..., Awaitable[Any]]]
+
+    @classmethod
+    def of(cls, callable_obj: Callable[..., Any]) -> "_CallablePair":
+        return cls(sync=callable_obj, aio=getattr(callable_obj, "aio", None))
+
+
+# .aio 版が無い場合の同期呼び出し用。既定の executor より小さく上限を設ける
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=4, thread_name_prefix="modal-sync"
+)
+
+
+async def _invoke(pair: _CallablePair, *args, **kwargs):
+    """.aio 版があれば await し、なければ同期版をスレッド経由で実行する"""
 
-    aio_impl = getattr(callable_obj, "aio", None)
-    if aio_impl is not None:
-        return await aio_impl(*args, **kwargs)
+    if pair.aio is not None:
+        return await pair.aio(*args, **kwargs)
 
     loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, lambda: callable_obj(*args, **kwargs))
+    return await loop.run_in_executor(
+        _EXECUTOR, functools.partial(pair.sync, *args, **kwargs)
+    )
 
 
-async def _spawn_modal_function(modal_function, **kwargs) -> FunctionCall:
-    """Modal関数の spawn を非同期的に扱う"""
+def _spawn_pair(modal_function) -> _CallablePair:
+    """Modal関数の spawn を呼び出し用に解決する"""
 
     spawn_callable = getattr(modal_function, "spawn", None)
     if spawn_callable is None:
         raise AttributeError("指定された Modal 関数に spawn が見つかりません")
-    return await _run_aio_or_sync(spawn_callable, **kwargs)
+    return _CallablePair.of(spawn_callable)
+
+
+_FROM_NAME = _CallablePair.of(Function.from_name)
+_PRESERVE_SPAWN = _spawn_pair(_PRESERVE_FUNCTION)
 
 
-async def _await_function_call(
-    call: FunctionCall, timeout: Optional[float] = None
-) -> Optional[dict]:
-    """FunctionCall.get を非同期的に待ち受ける"""
+async def _poll_function_call(
+    call: FunctionCall, *, budget: float = 0.5
+) -> Tuple[bool, Optional[dict]]:
+    """FunctionCall の完了をクライアント側のタイムアウトで待つ
+
+    budget 秒以内に完了すれば (True, 結果)、間に合わなければ (False, None) を返す。
+    """
 
     get_callable = getattr(call, "get", None)
     if get_callable is None:
         raise AttributeError("FunctionCall に get が定義されていません")
-    return await _run_aio_or_sync(get_callable, timeout=timeout)
+    get_pair = _CallablePair.of(get_callable)
+
+    # .aio 版はキャンセルで打ち切れるが、同期版はスレッドを止められないため Modal 側にも期限を渡す
+    get_timeout = None if get_pair.aio is not None else budget
+    try:
+        result = await asyncio.wait_for(
+            _invoke(get_pair, timeout=get_timeout), timeout=budget
+        )
+    except (asyncio.TimeoutError, ModalTimeoutError):
+        return False, None
+    return True, result
+
+
+# 解決済みの Function の spawn を使い回し、クリックごとの名前解決の往復を省く
+_REMOTE_SPAWNS: dict[Tuple[str, str], _CallablePair] = {}
+_REMOTE_SPAWNS_LOCK = asyncio.Lock()
+
+
+async def _get_remote_spawn(app_name: str, function_name: str) -> _CallablePair:
+    """Function.from_name で解決した関数の spawn をアプリ名・関数名ごとに保持する"""
+
+    key = (app_name, function_name)
+    async with _REMOTE_SPAWNS_LOCK:
+        spawn = _REMOTE_SPAWNS.get(key)
+        if spawn is None:
+            remote_function: Function = await _invoke(
+                _FROM_NAME, app_name, function_name
+            )
+            spawn = _spawn_pair(remote_function)
+            _REMOTE_SPAWNS[key] = spawn
+    return spawn
 
 
-async def _get_remote_function(app_name: str, function_name: str) -> Function:
-    """Function.from_name の同期/非同期差を吸収する"""
+def _forget_remote_spawn(app_name: str, function_name: str) -> None:
+    """見つからなかった Function をキャッシュから外し、次回は名前解決し直す"""
 
-    return await _run_aio_or_sync(Function.from_name, app_name, function_name)
+    _REMOTE_SPAWNS.pop((app_name, function_name), None)
 
 
-def _run_async(coro):
-    """Gradioコールバックから安全に非同期処理を実行する"""
+def _start_background_loop() -> asyncio.AbstractEventLoop:
+    """Gradioコールバックで共有するイベントループを常駐スレッドで起動する"""
+
     try:
-        return asyncio.run(coro)
-    except RuntimeError as err:  # 既存イベントループが動作中の場合に備える
-        if "asyncio.run() cannot be called" not in str(err):
-            raise
+        import uvloop
+    except ImportError:
         loop = asyncio.new_event_loop()
+    else:
+        # インストールされていれば高速な uvloop を使う (任意依存)
+        loop = uvloop.new_event_loop()
+    threading.Thread(
+        target=loop.run_forever, name="preserve-model-gui-loop", daemon=True
+    ).start()
+    return loop
+
+
+# クリックごとにイベントループを作り直さないよう、全ての非同期処理をこのループで実行する
+_LOOP = _start_background_loop()
+
+
+# ローカル実行では app.run() のコンテキストを GUI 終了まで保持し、クリックごとの起動を省く
+_LOCAL_APP: Optional[Any] = None
+_LOCAL_APP_CONTEXT: Optional[Any] = None
+_LOCAL_APP_LOCK = asyncio.Lock()
+
+
+async def _get_local_app() -> Any:
+    """初回のみ modal.App.run(detach=True) に入り、以降は同じ実行中Appを返す"""
+
+    global _LOCAL_APP, _LOCAL_APP_CONTEXT
+    async with _LOCAL_APP_LOCK:
+        if _LOCAL_APP is None:
+            context = _APP.run(detach=True)
+            _LOCAL_APP = await context.__aenter__()
+            _LOCAL_APP_CONTEXT = context
+        return _LOCAL_APP
+
+
+async def _close_local_app(expected: Optional[Any] = None) -> None:
+    """保持している app.run() のコンテキストを抜ける (detach のため実行中の処理は継続する)
+
+    expected を渡した場合は、そのAppがまだ保持されているときだけ閉じる。
+    """
+
+    global _LOCAL_APP, _LOCAL_APP_CONTEXT
+    async with _LOCAL_APP_LOCK:
+        if expected is not None and _LOCAL_APP is not expected:
+            # 別の呼び出しが既に開き直している
+            return
+        context = _LOCAL_APP_CONTEXT
+        _LOCAL_APP = _LOCAL_APP_CONTEXT = None
+        if context is None:
+            return
         try:
-            asyncio.set_event_loop(loop)
-            return loop.run_until_complete(coro)
-        finally:
-            asyncio.set_event_loop(None)
-            loop.close()
+            await context.__aexit__(None, None, None)
+        except Exception:
+            pass
+
+
+def _shutdown_local_app() -> None:
+    """GUI終了時に共有Appのコンテキストを閉じる"""
+
+    if _LOCAL_APP_CONTEXT is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_close_local_app(), _LOOP).result(timeout=30)
+    except Exception:
+        pass
+
+
+atexit.register(_shutdown_local_app)
 
 
 async def _invoke_preserve(
     repo_id: str,
-    filename: str,
+    filenames: list[str],
     revision: Optional[str],
     destination_subdir: Optional[str],
 ) -> Tuple[FunctionCall, bool, Optional[dict], Optional[Any]]:
-    async def _spawn_and_poll(
-        modal_function, app_handle: Optional[Any], **spawn_kwargs
-    ) -> Tuple[FunctionCall, bool, Optional[dict], Optional[Any]]:
-        call = await _spawn_modal_function(modal_function, **spawn_kwargs)
-        result = None
-        try:
-            result = await _await_function_call(call, timeout=0.5)
-            completed = True
-        except (asyncio.TimeoutError, ModalTimeoutError):
-            completed = False
-        return call, completed, result, app_handle
+    spawn_kwargs = {
+        "repo_id": repo_id,
+        "filename": filenames[0] if len(filenames) == 1 else None,
+        "revision": revision or None,
+        "destination_subdir": destination_subdir or None,
+    }
+    if len(filenames) > 1:
+        # 複数ファイルは 1 回の spawn にまとめ、コンテナ側で並列に取得させる
+        spawn_kwargs["filenames"] = filenames
 
     if CONFIG.use_deployed:
+        # from_name は遅延解決のため、存在確認は spawn 時に行われる
         try:
-            remote_function: Function = await _get_remote_function(
+            remote_spawn = await _get_remote_spawn(
                 CONFIG.deployed_app_name, CONFIG.deployed_function_name
             )
+            call = await _invoke(remote_spawn, **spawn_kwargs)
         except ModalNotFoundError as exc:  # デプロイ済み関数が存在しない場合
+            _forget_remote_spawn(
+                CONFIG.deployed_app_name, CONFIG.deployed_function_name
+            )
             raise ModalInvalidError(
                 f"デプロイ済みのアプリ '{CONFIG.deployed_app_name}' または関数 '{CONFIG.deployed_function_name}' が見つかりません"
             ) from exc
-        return await _spawn_and_poll(
-            remote_function,
-            None,
-            repo_id=repo_id,
-            filename=filename,
-            revision=revision or None,
-            destination_subdir=destination_subdir or None,
-        )
+        completed, result = await _poll_function_call(call)
+        return call, completed, result, None
 
-    async with _APP.run(detach=True) as running_app:
-        return await _spawn_and_poll(
-            _PRESERVE_FUNCTION,
-            running_app,
-            repo_id=repo_id,
-            filename=filename,
-            revision=revision or None,
-            destination_subdir=destination_subdir or None,
-        )
+    running_app = await _get_local_app()
+    try:
+        call = await _invoke(_PRESERVE_SPAWN, **spawn_kwargs)
+    except (ModalConnectionError, ModalClientClosed, ModalNotFoundError):
+        # 接続が失われたか、共有アプリが停止している場合のみ、次回は起動し直す
+        await _close_local_app(running_app)
+        raise
+    # get() で届くリモート側のエラー (HF の 404 など) ではアプリを閉じない
+    completed, result = await _poll_function_call(call)
+    return call, completed, result, running_app
 
 
-def _schedule_app_stop(call: FunctionCall, app_handle: Optional[Any]) -> None:
-    """FunctionCall完了後にAppを停止する補助処理をバックグラウンドで走らせる"""
+# 背景ループに投げたキャンセル処理。終了時に待ち合わせるため保持する
+_PENDING_CANCELS: set[concurrent.futures.Future] = set()
+_PENDING_CANCELS_LOCK = threading.Lock()
 
-    if app_handle is None or not hasattr(app_handle, "stop"):
-        return
 
-    async def _wait_and_stop() -> None:
-        try:
-            await _await_function_call(call, timeout=None)
-        except Exception:
-            pass
+def _cancel_inflight_call(call: FunctionCall) -> None:
+    """GUI側が中断された場合にFunctionCallをキャンセルする (共有Appは停止しない)"""
+
+    async def _cancel() -> None:
         try:
-            await _run_aio_or_sync(app_handle.stop)
+            await _invoke(_CallablePair.of(call.cancel), terminate_containers=True)
         except Exception:
             pass
 
-    threading.Thread(target=lambda: asyncio.run(_wait_and_stop()), daemon=True).start()
+    future = asyncio.run_coroutine_threadsafe(_cancel(), _LOOP)
+    with _PENDING_CANCELS_LOCK:
+        _PENDING_CANCELS.add(future)
+    future.add_done_callback(_discard_pending_cancel)
 
 
-def _cancel_inflight_call(call: FunctionCall, app_handle: Optional[Any]) -> None:
-    """GUI側が中断された場合にFunctionCallをキャンセルしAppも終了させる"""
+def _discard_pending_cancel(future: concurrent.futures.Future) -> None:
+    with _PENDING_CANCELS_LOCK:
+        _PENDING_CANCELS.discard(future)
 
-    async def _cancel_and_stop() -> None:
-        try:
-            await _run_aio_or_sync(call.cancel, terminate_containers=True)
-        except Exception:
-            pass
 
-        if app_handle is None or not hasattr(app_handle, "stop"):
-            return
-        try:
-            await _run_aio_or_sync(app_handle.stop)
-        except Exception:
-            pass
+def _drain_pending_cancels(timeout: float = 10.0) -> None:
+    """GUI終了時に送信中のキャンセルが届くまで待つ"""
 
-    threading.Thread(
-        target=lambda: asyncio.run(_cancel_and_stop()), daemon=True
-    ).start()
+    with _PENDING_CANCELS_LOCK:
+        pending = list(_PENDING_CANCELS)
+    if pending:
+        concurrent.futures.wait(pending, timeout=timeout)
+
+
+# atexit は登録と逆順に実行されるため、共有Appを閉じる前にキャンセルを送り切る
+atexit.register(_drain_pending_cancels)
+
+
+def _cancel_when_spawned(pending: concurrent.futures.Future) -> None:
+    """_invoke_preserve の完了後、生成された FunctionCall をキャンセルする"""
+
+    if pending.cancelled() or pending.exception() is not None:
+        return
+    call, completed = pending.result()[:2]
+    if not completed:
+        _cancel_inflight_call(call)
+
+
+# Hugging Face の URL を 1 回の照合で (種別, 所有者, リポジトリ名, リビジョン, ファイルパス) に分解する
+# スキームとホストは大文字小文字を区別せず、連続した '/' は 1 つの区切りとして扱う
+_HF_URL_RE = re.compile(
+    r"^(?i:https?://(?:[^/?#]*\.)?huggingface\.co)(?::\d+)?/+"
+    r"(?:(datasets|spaces|models)/+)?"
+    r"([^/?#]+)/+([^/?#]+)"
+    r"(?:/+(?:resolve|blob)/+([^/?#]+))?"
+    r"(?:/+([^?#]*))?"
+    r"(?:[?#].*)?$"
+)
 
 
 def _parse_repo_and_filename(raw: str) -> Tuple[str, str, Optional[str]]:
@@ -199,121 +341,136 @@ def _parse_repo_and_filename(raw: str) -> Tuple[str, str, Optional[str]]:
     if not value:
         raise ValueError("リポジトリとファイルの指定が空です。")
 
+    # 最も多い 'リポジトリID::ファイルパス' 形式を先に判定する
+    # ただし '::' より前が URL の場合は、ファイルパス中の '::' とみなして URL として扱う
+    head, sep, tail = value.partition("::")
+    if sep and "huggingface.co" not in head.lower():
+        repo_id, filename = head.strip(), tail.strip()
+        if not repo_id or not filename:
+            raise ValueError("リポジトリIDとファイルパスの両方を指定してください。")
+        return repo_id, filename, None
+
     # Hugging Faceのresolve URLに対応
-    if "huggingface.co" in value:
-        parsed = urlparse(value)
-        parts = [p for p in parsed.path.split("/") if p]
-        if len(parts) < 3:
+    if "huggingface.co" in value.lower():
+        match = _HF_URL_RE.match(value)
+        if match is None:
             raise ValueError("URLからリポジトリIDとファイル名を特定できませんでした。")
 
-        special_prefixes = {"datasets", "spaces", "models"}
-        prefix = parts[0] if parts[0] in special_prefixes else None
-        repo_parts_start = 1 if prefix else 0
-        if len(parts) - repo_parts_start < 2:
-            raise ValueError("URLからリポジトリIDを特定できませんでした。")
-
-        repo_core_parts = parts[repo_parts_start : repo_parts_start + 2]
-        repo_id = "/".join(repo_core_parts)
-
-        filename_parts = parts[repo_parts_start + 2 :]
-        if not filename_parts:
-            raise ValueError("URLにファイルパスが含まれていません。")
-
-        revision = None
-        special_segment = filename_parts[0]
-        if len(filename_parts) >= 2 and special_segment in {"resolve", "blob"}:
-            revision = filename_parts[1]
-            filename_parts = filename_parts[2:]
-
-        if not filename_parts:
+        prefix, owner, name, revision, filename = match.groups()
+        filename = "/".join(part for part in (filename or "").split("/") if part)
+        if not filename:
+            if prefix is None and revision is None:
+                # パスがリポジトリIDだけの場合
+                raise ValueError(
+                    "URLからリポジトリIDとファイル名を特定できませんでした。"
+                )
             raise ValueError("URLにファイルパスが含まれていません。")
-
-        filename = "/".join(filename_parts)
         if prefix and prefix != "models":
             raise ValueError(
                 "現在のGUIはモデルリポジトリのみ対応しています。datasetsやspacesは直接指定してください。"
             )
-        return repo_id, filename, revision
+        return f"{owner}/{name}", filename, revision
 
-    if "::" in value:
-        repo_id, filename = (part.strip() for part in value.split("::", 1))
-    else:
-        parts = value.split()
-        if len(parts) < 2:
-            raise ValueError(
-                "スペースまたは'::'でリポジトリIDとファイルパスを区切ってください。"
-            )
-        repo_id, filename = parts[0], " ".join(parts[1:])
-
-    if not repo_id or not filename:
-        raise ValueError("リポジトリIDとファイルパスの両方を指定してください。")
+    parts = value.split()
+    if len(parts) < 2:
+        raise ValueError(
+            "スペースまたは'::'でリポジトリIDとファイルパスを区切ってください。"
+        )
+    repo_id, filename = parts[0], " ".join(parts[1:])
 
     return repo_id, filename, None
 
 
+def _auto_detect_subdir(filename: str) -> Optional[str]:
+    """ファイルパス中から保存先候補を推測する"""
+
+    # Hugging Face のパスは常に '/' 区切りなので Path を組み立てずに分割する
+    return next(
+        (part for part in filename.split("/") if part in _COMFY_MODEL_SUBDIRS_SET),
+        None,
+    )
+
+
 def download_model(
     repo_and_file: str,
     revision: str,
     destination_subdir: str,
 ):
+    import gradio as gr
+
     call: Optional[FunctionCall] = None
+    pending: Optional[concurrent.futures.Future] = None
     app_handle: Optional[Any] = None
+    completed = False
     finished_normally = False
     try:
+        # 1 行に 1 ファイルずつ指定でき、同じリポジトリなら 1 回の呼び出しにまとめる
+        lines = [line for line in repo_and_file.splitlines() if line.strip()]
         try:
-            repo_id, filename, revision_from_input = _parse_repo_and_filename(
-                repo_and_file
-            )
+            entries = [_parse_repo_and_filename(line) for line in lines or [""]]
         except ValueError as exc:
             yield str(exc), gr.update(interactive=True)
             return
 
-        def _auto_detect_subdir(filename: str) -> Optional[str]:
-            """ファイルパス中から保存先候補を推測する"""
-
-            for part in Path(filename).parts:
-                if part in _COMFY_MODEL_SUBDIRS:
-                    return part
-            return None
+        repo_id, _, revision_from_input = entries[0]
+        if any(
+            (entry_repo, entry_revision) != (repo_id, revision_from_input)
+            for entry_repo, _, entry_revision in entries[1:]
+        ):
+            yield (
+                "複数のファイルをまとめて保存する場合は、同じリポジトリ・リビジョンのファイルを指定してください。",
+                gr.update(interactive=True),
+            )
+            return
+        repo_id = repo_id.strip()
+        filenames = [entry_filename.strip() for _, entry_filename, _ in entries]
 
-        if destination_subdir == "(自動判定)":
+        if destination_subdir == _AUTO_SUBDIR_CHOICE:
             destination_subdir = ""
 
         chosen_revision = revision_from_input or revision.strip() or "main"
         chosen_subdir = destination_subdir or None
         auto_selected = False
-        detected_subdir = _auto_detect_subdir(filename)
+        detected_subdirs = [_auto_detect_subdir(name) for name in filenames]
 
         if chosen_subdir is None:
-            if detected_subdir is None:
+            if None in detected_subdirs:
                 yield (
                     "ComfyUIの保存先を自動判定できませんでした。\n"
                     "プルダウンから保存先サブディレクトリを選択してください。",
                     gr.update(interactive=True),
                 )
                 return
-            chosen_subdir = detected_subdir
+            # 複数ファイルの場合はコンテナ側でファイルごとに判定させる
+            if len(filenames) == 1:
+                chosen_subdir = detected_subdirs[0]
             auto_selected = True
+        subdir_label = (
+            f"自動判定({', '.join(dict.fromkeys(detected_subdirs))})"
+            if auto_selected
+            else chosen_subdir
+        )
 
+        pending = asyncio.run_coroutine_threadsafe(
+            _invoke_preserve(
+                repo_id=repo_id,
+                filenames=filenames,
+                revision=chosen_revision,
+                destination_subdir=chosen_subdir,
+            ),
+            _LOOP,
+        )
         yield (
             "Modalへリクエストを送信しています...\n"
-            f"- リポジトリ: {repo_id.strip()}\n"
-            f"- 対象ファイル: {filename.strip()}\n"
+            f"- リポジトリ: {repo_id}\n"
+            f"- 対象ファイル: {', '.join(filenames)}\n"
             f"- リビジョン: {chosen_revision}\n"
             "この処理には数十秒かかる場合があります。",
             gr.update(interactive=False),
         )
 
         try:
-            call, completed, result_info, app_handle = _run_async(
-                _invoke_preserve(
-                    repo_id=repo_id.strip(),
-                    filename=filename.strip(),
-                    revision=chosen_revision,
-                    destination_subdir=chosen_subdir,
-                )
-            )
-            _schedule_app_stop(call, app_handle)
+            call, completed, result_info, app_handle = pending.result()
         except ModalConnectionError:
             yield "Modalサーバーに接続できません。CLIでログイン済みか、ネットワーク設定をご確認ください。", gr.update(
                 interactive=True
@@ -343,7 +500,17 @@ def download_model(
 
         call_id = getattr(call, "object_id", None)
         app_id = getattr(app_handle, "app_id", None) if app_handle else None
-        if completed:
+        saved_files = (result_info or {}).get("files", ())
+        skipped = bool(result_info) and (
+            all(saved.get("skipped") for saved in saved_files)
+            if saved_files
+            else bool(result_info.get("skipped"))
+        )
+        if completed and skipped:
+            status_message = (
+                "同じリポジトリ・コミットのファイルが既に保存済みのため、ダウンロードを省略しました。"
+            )
+        elif completed:
             status_message = "Modal側でモデル保存処理が完了しました。"
         else:
             followups = [
@@ -361,34 +528,50 @@ def download_model(
                 )
             status_message = "\n".join(followups)
 
-        msg_lines = [
-            status_message,
-            f"- 実行モード: {'デプロイ済み関数' if CONFIG.use_deployed else 'ローカル(app.run)'}",
-            f"- リポジトリ: {repo_id.strip()}",
-            f"- 対象ファイル: {filename.strip()}",
-            f"- リビジョン: {chosen_revision}",
-            f"- 保存先サブディレクトリ: {chosen_subdir if not auto_selected else f'自動判定({chosen_subdir})'}",
-        ]
+        # 行ごとの文字列リストを作らず、バッファへ順に書き込む
+        message = io.StringIO()
+        message.write(status_message)
+        message.write(
+            f"\n- 実行モード: {'デプロイ済み関数' if CONFIG.use_deployed else 'ローカル(app.run)'}"
+            f"\n- リポジトリ: {repo_id}"
+            f"\n- 対象ファイル: {', '.join(filenames)}"
+            f"\n- リビジョン: {chosen_revision}"
+            f"\n- 保存先サブディレクトリ: {subdir_label}"
+        )
         if result_info and completed:
+            for saved in saved_files:
+                skipped_note = " 保存済みのため省略" if saved.get("skipped") else ""
+                message.write(
+                    f"\n- 保存先パス: {saved['destination']} ({saved['size_bytes']} バイト{skipped_note})"
+                )
             destination_path = result_info.get("destination")
             size_bytes = result_info.get("size_bytes")
+            commit = result_info.get("commit")
             completed_at = result_info.get("completed_at")
             if destination_path:
-                msg_lines.append(f"- 保存先パス: {destination_path}")
+                message.write(f"\n- 保存先パス: {destination_path}")
             if size_bytes is not None:
-                msg_lines.append(f"- 保存サイズ: {size_bytes} バイト")
+                message.write(f"\n- 保存サイズ: {size_bytes} バイト")
+            if commit:
+                message.write(f"\n- コミット: {commit}")
             if completed_at:
-                msg_lines.append(f"- 完了時刻(UTC): {completed_at}")
+                message.write(f"\n- 完了時刻(UTC): {completed_at}")
         if app_id:
-            msg_lines.append(f"- App ID: {app_id}")
+            message.write(f"\n- App ID: {app_id}")
         if call_id:
-            msg_lines.append(f"- コールID: {call_id}")
+            message.write(f"\n- コールID: {call_id}")
 
         finished_normally = True
-        yield "\n".join(msg_lines), gr.update(interactive=True)
+        yield message.getvalue(), gr.update(interactive=True)
     finally:
-        if call is not None and not finished_normally:
-            _cancel_inflight_call(call, app_handle)
+        if not finished_normally:
+            if call is not None:
+                # 完了済みの呼び出しには cancel を送らない
+                if not completed:
+                    _cancel_inflight_call(call)
+            elif pending is not None:
+                # 途中経過の表示中に中断された場合は、spawn の完了を待ってキャンセルする
+                pending.add_done_callback(_cancel_when_spawned)
 
 
 def _parse_cli_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
@@ -438,29 +621,35 @@ def _parse_cli_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
     return parser.parse_args(argv)
 
 
+_HEADER_MD = """### Hugging FaceのモデルをModalボリュームに保存
+`preserve_model.py` の処理をGUIから呼び出します。Modal CLIでログイン済みであることを確認してください。\n\n- デプロイ済み関数を利用したい場合は `--use-deployed` フラグ、または環境変数 `PRESERVE_MODEL_USE_DEPLOYED=1` を指定してください。\n- デフォルト以外のアプリ名・関数名でデプロイしているときは `--deployed-app-name` / `--deployed-function-name` あるいは環境変数 `PRESERVE_MODEL_DEPLOYED_APP` / `PRESERVE_MODEL_DEPLOYED_FUNCTION` で上書きできます。"""
+
+
 def build_interface() -> gr.Blocks:
+    import gradio as gr
+
     with gr.Blocks(title="Modal: Hugging Face モデル取り込み") as demo:
-        gr.Markdown(
-            """### Hugging FaceのモデルをModalボリュームに保存
-`preserve_model.py` の処理をGUIから呼び出します。Modal CLIでログイン済みであることを確認してください。\n\n- デプロイ済み関数を利用したい場合は `--use-deployed` フラグ、または環境変数 `PRESERVE_MODEL_USE_DEPLOYED=1` を指定してください。\n- デフォルト以外のアプリ名・関数名でデプロイしているときは `--deployed-app-name` / `--deployed-function-name` あるいは環境変数 `PRESERVE_MODEL_DEPLOYED_APP` / `PRESERVE_MODEL_DEPLOYED_FUNCTION` で上書きできます。"""
-        )
+        gr.Markdown(_HEADER_MD)
 
         repo_and_file_input = gr.Textbox(
             label="リポジトリとファイルの指定",
             value="",
+            lines=3,
             placeholder="Comfy-Org/Qwen-Image-Edit_ComfyUI::split_files/diffusion_models/model.safetensors",
-            info="'リポジトリID::ファイルパス'またはスペース区切り、もしくはresolve URLを指定できます",
+            info=(
+                "'リポジトリID::ファイルパス'またはスペース区切り、もしくはresolve URLを指定できます。"
+                "同じリポジトリのファイルは1行ずつ並べるとまとめて保存します"
+            ),
         )
         revision_input = gr.Textbox(
             label="リビジョン(ブランチ名/タグ/コミット)",
             value="main",
             info="空欄の場合はmainを使用します (URLにresolveが含まれていた場合はその指定を優先)",
         )
-        subdir_choices = ["(自動判定)"] + _COMFY_MODEL_SUBDIRS
         destination_dropdown = gr.Dropdown(
             label="保存先サブディレクトリ",
-            choices=subdir_choices,
-            value="(自動判定)",
+            choices=list(_SUBDIR_CHOICES),
+            value=_AUTO_SUBDIR_CHOICE,
             info="空欄の場合はファイルパスから自動で判定します",
         )
 
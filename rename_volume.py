@@ -1,10 +1,19 @@
 import argparse
 import os
 import shutil
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import Tuple
 
 import modal
 
+# Volume はネットワーク越しのため、トップレベルの項目ごとに並列でコピーする
+COPY_MAX_WORKERS = 32
+# コピー結果のログはこの件数か秒数のどちらかに達したらまとめて出力する
+LOG_FLUSH_INTERVAL = 100
+LOG_FLUSH_SECONDS = 2.0
+
 
 def _build_app(
     old_volume_name: str, new_volume_name: str
@@ -31,7 +40,14 @@ def _build_app(
     def copy_data() -> None:
         """古いVolumeから新しいVolumeへデータをコピーします。"""
 
-        if not os.listdir(source_mount):
+        # 一覧は 1 回だけ取得し、空判定とコピー対象の両方に使う
+        try:
+            with os.scandir(source_mount) as iterator:
+                entries = list(iterator)
+        except FileNotFoundError:
+            entries = []
+
+        if not entries:
             print(
                 f"Source volume '{old_volume_name}' is empty or does not exist. Nothing to copy."
             )
@@ -39,33 +55,61 @@ def _build_app(
 
         os.makedirs(dest_mount, exist_ok=True)
 
-        copied_items = 0
-        skipped_items = 0
+        def _copy_one(entry: os.DirEntry) -> Tuple[bool, str]:
+            """1 項目をコピーし、成功したかどうかとログ行を返す"""
 
-        for item in os.listdir(source_mount):
-            source_item_path = os.path.join(source_mount, item)
+            item = entry.name
+            source_item_path = entry.path
             dest_item_path = os.path.join(dest_mount, item)
 
             try:
-                if os.path.isdir(source_item_path):
+                # DirEntry の種別情報を使い、項目ごとの stat を省く
+                if entry.is_dir():
                     shutil.copytree(
                         source_item_path,
                         dest_item_path,
                         dirs_exist_ok=True,
                     )
-                    print(f"Copied directory: {item}")
-                else:
-                    shutil.copy2(source_item_path, dest_item_path)
-                    print(f"Copied file: {item}")
-
-                copied_items += 1
+                    return True, f"Copied directory: {item}"
+                shutil.copy2(source_item_path, dest_item_path)
+                return True, f"Copied file: {item}"
 
             except FileExistsError:
-                print(f"Item '{item}' already exists in destination. Skipping.")
-                skipped_items += 1
+                return False, f"Item '{item}' already exists in destination. Skipping."
             except (OSError, shutil.Error) as exc:
-                print(f"Could not copy '{item}'. Reason: {exc}")
-                skipped_items += 1
+                return False, f"Could not copy '{item}'. Reason: {exc}"
+
+        copied_items = 0
+        skipped_items = 0
+        # 項目ごとの print は書き込みが多いため、まとめて stdout に流す
+        log_lines: list[str] = []
+
+        with ThreadPoolExecutor(max_workers=COPY_MAX_WORKERS) as executor:
+            pending = {executor.submit(_copy_one, entry) for entry in entries}
+            last_flush = time.monotonic()
+            while pending:
+                # 大きなディレクトリの完了待ちでログが滞らないよう、一定時間ごとに起きて出力する
+                done, pending = wait(
+                    pending, timeout=LOG_FLUSH_SECONDS, return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    copied, log_line = future.result()
+                    if copied:
+                        copied_items += 1
+                    else:
+                        skipped_items += 1
+                    log_lines.append(log_line)
+                if log_lines and (
+                    len(log_lines) >= LOG_FLUSH_INTERVAL
+                    or time.monotonic() - last_flush >= LOG_FLUSH_SECONDS
+                ):
+                    sys.stdout.write("\n".join(log_lines) + "\n")
+                    sys.stdout.flush()
+                    log_lines.clear()
+                    last_flush = time.monotonic()
+
+        if log_lines:
+            sys.stdout.write("\n".join(log_lines) + "\n")
 
         print("\n" + "=" * 30)
         print("Copy operation summary:")
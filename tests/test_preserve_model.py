@@ -0,0 +1,69 @@
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("modal")
+
+import preserve_model  # noqa: E402
+
+COMMIT = "0123456789abcdef0123456789abcdef01234567"
+
+
+@pytest.fixture
+def hub(tmp_path, monkeypatch):
+    """huggingface_hub を差し替え、保存先を一時ディレクトリへ向ける"""
+
+    calls = []
+
+    class HfApi:
+        def model_info(self, repo_id, revision=None):
+            return types.SimpleNamespace(sha=COMMIT)
+
+    def snapshot_download(repo_id, revision, allow_patterns, local_dir, max_workers):
+        calls.append(list(allow_patterns))
+        for name in allow_patterns:
+            path = Path(local_dir) / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b"weights")
+
+    module = types.ModuleType("huggingface_hub")
+    module.HfApi = HfApi
+    module.hf_hub_download = None
+    module.snapshot_download = snapshot_download
+    monkeypatch.setitem(sys.modules, "huggingface_hub", module)
+    monkeypatch.setattr(preserve_model, "MODEL_DIR", tmp_path)
+    monkeypatch.setattr(preserve_model, "DOWNLOAD_STAGING_DIR", tmp_path / ".hf_download")
+    monkeypatch.setattr(preserve_model, "DOWNLOAD_RECORD_DIR", tmp_path / ".preserve_records")
+    return calls
+
+
+def _run(**kwargs):
+    return preserve_model.preserve_model.get_raw_f()(repo_id="a/b", **kwargs)
+
+
+def test_multiple_files_skip_saved(hub, tmp_path):
+    first = _run(filenames="split/vae/x.bin, split/loras/y.bin")
+    assert hub == [["split/vae/x.bin", "split/loras/y.bin"]]
+    assert first["commit"] == COMMIT
+    assert [(saved["destination"], saved["skipped"]) for saved in first["files"]] == [
+        ((tmp_path / "vae" / "x.bin").as_posix(), False),
+        ((tmp_path / "loras" / "y.bin").as_posix(), False),
+    ]
+
+    second = _run(filenames=["split/vae/x.bin", "split/vae/z.bin", "split/vae/x.bin"])
+    assert hub[1:] == [["split/vae/z.bin"]]
+    assert [saved["skipped"] for saved in second["files"]] == [True, False]
+    assert all(saved["size_bytes"] == len(b"weights") for saved in second["files"])
+
+
+def test_multiple_files_same_destination(hub, tmp_path):
+    with pytest.raises(ValueError) as excinfo:
+        _run(filenames=["a/vae/x.bin", "b/vae/x.bin"])
+    assert "a/vae/x.bin と b/vae/x.bin の保存先が同じ" in str(excinfo.value)
+    assert hub == []
+
+    with pytest.raises(ValueError):
+        _run(filenames=["a/x.bin", "b/x.bin"], destination_subdir="loras")
+    assert hub == []
@@ -0,0 +1,93 @@
+import pytest
+
+pytest.importorskip("modal")
+
+from preserve_model_gui import _parse_repo_and_filename  # noqa: E402
+
+URL_NOT_PARSED = "URLからリポジトリIDとファイル名を特定できませんでした。"
+URL_WITHOUT_FILE = "URLにファイルパスが含まれていません。"
+URL_NOT_MODEL = (
+    "現在のGUIはモデルリポジトリのみ対応しています。datasetsやspacesは直接指定してください。"
+)
+
+
+@pytest.mark.parametrize(
+    ("raw", "expected"),
+    [
+        (
+            "https://huggingface.co/Comfy-Org/Qwen/resolve/main/split_files/vae/x.safetensors",
+            ("Comfy-Org/Qwen", "split_files/vae/x.safetensors", "main"),
+        ),
+        (
+            "https://huggingface.co/a/b/resolve/main/x.bin?download=true#frag",
+            ("a/b", "x.bin", "main"),
+        ),
+        ("https://huggingface.co/models/a/b/blob/v1/x.bin", ("a/b", "x.bin", "v1")),
+        ("https://huggingface.co/a/b/x/y.bin", ("a/b", "x/y.bin", None)),
+        ("https://huggingface.co/a/b/resolve", ("a/b", "resolve", None)),
+        ("HTTPS://huggingface.co/a/b/resolve/main/x", ("a/b", "x", "main")),
+        ("https://HuggingFace.CO/a/b/resolve/main/x", ("a/b", "x", "main")),
+        ("https://huggingface.co//a/b/resolve/main/x", ("a/b", "x", "main")),
+        ("https://huggingface.co/a//b/resolve//main/x//y", ("a/b", "x/y", "main")),
+        ("https://www.huggingface.co/a/b/resolve/main/x", ("a/b", "x", "main")),
+    ],
+)
+def test_parse_url(raw, expected):
+    assert _parse_repo_and_filename(raw) == expected
+
+
+@pytest.mark.parametrize(
+    ("raw", "message"),
+    [
+        ("https://huggingface.co/a/b", URL_NOT_PARSED),
+        ("https://huggingface.co/a/b/", URL_NOT_PARSED),
+        ("https://huggingface.co/models/x", URL_NOT_PARSED),
+        ("https://huggingface.co/a", URL_NOT_PARSED),
+        ("https://huggingface.co/a/b?x=1", URL_NOT_PARSED),
+        ("https://evilhuggingface.co/a/b/x", URL_NOT_PARSED),
+        ("https://huggingface.co/models/a/b", URL_WITHOUT_FILE),
+        ("https://huggingface.co/a/b/resolve/main", URL_WITHOUT_FILE),
+        ("https://huggingface.co/a/b/resolve/main/", URL_WITHOUT_FILE),
+        ("https://huggingface.co/datasets/a/b", URL_WITHOUT_FILE),
+        ("https://huggingface.co/datasets/a/b/resolve/main/x", URL_NOT_MODEL),
+        ("https://huggingface.co/spaces/a/b/x", URL_NOT_MODEL),
+    ],
+)
+def test_parse_url_errors(raw, message):
+    with pytest.raises(ValueError) as excinfo:
+        _parse_repo_and_filename(raw)
+    assert str(excinfo.value) == message
+
+
+@pytest.mark.parametrize(
+    ("raw", "expected"),
+    [
+        ("a/b::c/d.bin", ("a/b", "c/d.bin", None)),
+        ("  a/b :: c/d.bin  ", ("a/b", "c/d.bin", None)),
+        ("a/b::c::d.bin", ("a/b", "c::d.bin", None)),
+        ("a/b c/d.bin", ("a/b", "c/d.bin", None)),
+        ("a/b c d.bin", ("a/b", "c d.bin", None)),
+        (
+            "https://huggingface.co/a/b/resolve/main/x::y",
+            ("a/b", "x::y", "main"),
+        ),
+    ],
+)
+def test_parse_non_url_and_separator(raw, expected):
+    assert _parse_repo_and_filename(raw) == expected
+
+
+@pytest.mark.parametrize(
+    ("raw", "message"),
+    [
+        ("", "リポジトリとファイルの指定が空です。"),
+        ("   ", "リポジトリとファイルの指定が空です。"),
+        ("a/b::", "リポジトリIDとファイルパスの両方を指定してください。"),
+        ("::c/d.bin", "リポジトリIDとファイルパスの両方を指定してください。"),
+        ("a/b", "スペースまたは'::'でリポジトリIDとファイルパスを区切ってください。"),
+    ],
+)
+def test_parse_non_url_errors(raw, message):
+    with pytest.raises(ValueError) as excinfo:
+        _parse_repo_and_filename(raw)
+    assert str(excinfo.value) == message